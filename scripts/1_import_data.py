@@ -1,6 +1,7 @@
 import os
 from google.cloud import bigquery
 import pandas as pd
+from registro_listings import carregar_registro, codificar_listings, salvar_registro, ARQUIVO_REGISTRO
 
 # Configurar caminhos
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -103,6 +104,10 @@ WHERE
 GROUP BY id_seazone;
 """
 
+# Registro persistente de listings: códigos novos recebem o próximo ID livre
+registro = carregar_registro()
+print(f"Registro de listings: {len(registro)} códigos\n")
+
 # Executar queries e salvar CSVs
 queries = {
     'meta_analysis_price': query_price,
@@ -113,6 +118,13 @@ queries = {
 for name, query in queries.items():
     print(f"Executando query: {name}")
     df = client.query(query).to_dataframe()
+
+    # Codificar listings e ordenar por ID: o 2_data_prepar.py faz merge join sobre essa ordem
+    df, registro = codificar_listings(df, registro)
+    df = df.sort_values("listing_id", kind="stable", ignore_index=True)
+
+    # Gravar o registro antes do CSV: todo ID gravado já fica registrado
+    salvar_registro(registro)
     
     # Salvar arquivo
     output_path = os.path.join(RAW_DIR, f'{name}.csv')
@@ -120,4 +132,6 @@ for name, query in queries.items():
     print(f"Salvo: {output_path}")
     print(f"Registros: {len(df)}\n")
 
+print(f"Salvo: {ARQUIVO_REGISTRO} ({len(registro)} códigos)\n")
+
 print("Processo concluído!")
\ No newline at end of file
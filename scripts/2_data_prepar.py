@@ -1,6 +1,8 @@
 import pandas as pd
 import os
+import argparse
 import numpy as np
+from regras_classificacao import carregar_regras, classificar
 
 # Configurar caminhos
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -9,69 +11,212 @@ DATA_DIR = os.path.join(PROJECT_ROOT, 'data')
 RAW_DIR = os.path.join(DATA_DIR, 'raw')
 PROCESSED_DIR = os.path.join(DATA_DIR, 'processed')
 
+ARQUIVO_LOCATION = os.path.join(RAW_DIR, "meta_analysis_location.csv")
+ARQUIVO_META = os.path.join(RAW_DIR, "meta_analysis_performance_value_meta.csv")
+ARQUIVO_PRICES = os.path.join(RAW_DIR, "meta_analysis_price.csv")
+
+# Argumentos de linha de comando (parse_known_args para funcionar também em células interativas)
+parser = argparse.ArgumentParser(description="Prepara os dados do Meta Performance Dashboard")
+parser.add_argument("--streaming", action="store_true",
+                    help="Processa o arquivo de performance em blocos, sem carregar os CSVs inteiros na memória. "
+                         "Os listing_id vêm do registro em data/raw/listing_registry.csv, como no modo em memória")
+parser.add_argument("--chunksize", type=int, default=50_000,
+                    help="Linhas por bloco no modo streaming")
+args, _ = parser.parse_known_args()
+
 # Criar diretórios se não existirem
 os.makedirs(PROCESSED_DIR, exist_ok=True)
 
+# O registro de listings fica em data/raw (mantido pelo 1_import_data.py); remover a cópia antiga
+# que versões anteriores deste script gravavam junto das saídas
+registro_antigo = os.path.join(PROCESSED_DIR, "listing_registry.csv")
+if os.path.exists(registro_antigo):
+    os.remove(registro_antigo)
+
 print("🚀 Iniciando preparação dos dados...")
 print(f"📂 Lendo arquivos de: {RAW_DIR}")
 print(f"💾 Salvando resultados em: {PROCESSED_DIR}")
 
 # %%
-# Ler os 3 arquivos CSV
-try:
-    df_location = pd.read_csv(os.path.join(RAW_DIR, "meta_analysis_location.csv"))
-    df_meta = pd.read_csv(os.path.join(RAW_DIR, "meta_analysis_performance_value_meta.csv"))
-    df_prices = pd.read_csv(os.path.join(RAW_DIR, "meta_analysis_price.csv"))
-    print("✅ Todos os arquivos CSV lidos com sucesso")
-except FileNotFoundError as e:
-    print(f"❌ Erro ao ler arquivos: {e}")
-    print("Execute primeiro o script 1_import_data.py")
-    exit(1)
+# Funções de leitura e junção
 
-# %%
-# Renomear colunas do df_meta conforme o padrão
-df_meta = df_meta.rename(columns={
-    "group_name": "categoria",
-    "num_listing_blocked": "dias_bloqueados",
-    "n_days_status": "dias_ativo",
-    "listing_fat": "faturamento_mes",
-    "n_competitors": "n_concorrentes",
-    "meta_value": "meta",
-    "year_month": "mes_ano",
-    "to_competitors": "to_concorrentes",
-    "days_occupied": "dias_ocupados",
-    "total_days": "total_dias"
-})
-
-print("📝 Colunas renomeadas no df_meta")
+def renomear_colunas_meta(df_meta):
+    """Renomeia as colunas do df_meta conforme o padrão"""
+    return df_meta.rename(columns={
+        "group_name": "categoria",
+        "num_listing_blocked": "dias_bloqueados",
+        "n_days_status": "dias_ativo",
+        "listing_fat": "faturamento_mes",
+        "n_competitors": "n_concorrentes",
+        "meta_value": "meta",
+        "year_month": "mes_ano",
+        "to_competitors": "to_concorrentes",
+        "days_occupied": "dias_ocupados",
+        "total_days": "total_dias"
+    })
 
-# %%
-# Verificar nomes das colunas
-print("\n📌 Colunas de df_location:")
-print(df_location.columns.tolist())
+def exigir_listing_id(df, caminho):
+    """Garante que o arquivo bruto já foi codificado pelo registro de listings"""
+    if "listing_id" not in df.columns:
+        raise ValueError(f"{caminho} não tem listing_id. Execute novamente o 1_import_data.py")
 
-print("\n📌 Colunas de df_meta:")
-print(df_meta.columns.tolist())
+def preparar_ids(df, caminho):
+    """Descarta linhas sem listing_id e garante ordenação por ID (os arquivos brutos já saem ordenados)"""
+    exigir_listing_id(df, caminho)
+    # Só copia o DataFrame quando há algo a corrigir: no caso comum ele segue como foi lido
+    if df["listing_id"].isna().any():
+        df = df.dropna(subset=["listing_id"])
+    if df["listing_id"].dtype != "int64":
+        df = df.astype({"listing_id": "int64"})
+    if not df["listing_id"].is_monotonic_increasing:
+        df = df.sort_values("listing_id", kind="stable")
+    return df if df.index.equals(pd.RangeIndex(len(df))) else df.reset_index(drop=True)
 
-print("\n📌 Colunas de df_prices:")
-print(df_prices.columns.tolist())
+def marcar_duplicados(ids):
+    """Marca as repetições de um array de IDs ordenado (a primeira ocorrência não é marcada)"""
+    return np.r_[False, ids[1:] == ids[:-1]]
 
-# %%
-# Fazer merge entre os DataFrames
-print("\n🔗 Realizando merges dos DataFrames...")
-# Primeiro, juntar df_meta com df_prices
-df_merged = df_meta.merge(df_prices, on="listing", how="left")
+def merge_join_por_id(esquerda, direita):
+    """Left join por listing_id entre dois DataFrames ordenados; devolve o resultado e a contagem de chaves duplicadas e órfãs"""
+    ids_direita = direita["listing_id"].to_numpy()
+
+    # Chaves duplicadas ficam com a primeira ocorrência
+    duplicados = marcar_duplicados(ids_direita)
+    if duplicados.any():
+        direita = direita[~duplicados].reset_index(drop=True)
+        ids_direita = direita["listing_id"].to_numpy()
+
+    # Intercalar as duas sequências ordenadas: o sort estável (timsort) só mescla as duas sequências,
+    # em tempo linear. Com a direita primeiro, cada ID da esquerda vem logo depois do seu par da direita
+    ids_esquerda = esquerda["listing_id"].to_numpy()
+    ordem = np.argsort(np.concatenate([ids_direita, ids_esquerda]), kind="stable")
+    da_direita = ordem < len(ids_direita)
+    # Última linha da direita vista até cada linha da esquerda (-1 se nenhuma)
+    posicoes = np.maximum.accumulate(np.where(da_direita, ordem, -1))[~da_direita]
+    # Sentinela -1 no fim: a posição -1 nunca casa
+    encontrados = np.append(ids_direita, -1)[posicoes] == ids_esquerda
+    indexador = np.where(encontrados, posicoes, -1)
+
+    # As posições encontradas são crescentes: as repetições são linhas da direita já contadas
+    casados = indexador[encontrados]
+    relatorio = {
+        "duplicados": int(duplicados.sum()),
+        "sem_correspondencia": int((~encontrados).sum()),
+        "orfaos": int(len(ids_direita) - (casados.size - marcar_duplicados(casados).sum())),
+    }
+
+    df_join = esquerda.copy()
+    for coluna in direita.columns.drop(["listing", "listing_id"]):
+        df_join[coluna] = pd.api.extensions.take(direita[coluna].to_numpy(), indexador, allow_fill=True)
+    return df_join, relatorio
+
+def exibir_relatorio_join(relatorio):
+    """Mostra, por arquivo, as linhas sem listing e as chaves duplicadas, sem correspondência e órfãs"""
+    for fonte, contagens in relatorio.items():
+        if contagens["sem_listing"]:
+            print(f"⚠️ {fonte}: {contagens['sem_listing']} linhas sem listing descartadas")
+        if contagens["duplicados"]:
+            tratamento = "todas mantidas" if fonte == "df_meta" else "mantida a primeira ocorrência"
+            print(f"⚠️ {fonte}: {contagens['duplicados']} listings duplicados ({tratamento})")
+        if "orfaos" in contagens:
+            print(f"   - {fonte}: {contagens['sem_correspondencia']} listings sem correspondência, "
+                  f"{contagens['orfaos']} órfãos ignorados")
+
+def somar_relatorios(total, parcial):
+    """Acumula o relatório de join de um bloco no relatório total"""
+    if total is None:
+        return parcial
+    for fonte, contagens in parcial.items():
+        for chave, valor in contagens.items():
+            total[fonte][chave] += valor
+    return total
 
-# Depois, juntar com df_location
-df_final = df_merged.merge(df_location, on="listing", how="left")
+def juntar_fontes(df_meta, df_prices, df_location):
+    """Junta df_meta → df_prices → df_location por merge join sobre listing_id"""
+    relatorio = {}
+    fontes = {}
+    for fonte, df, caminho in (
+        ("df_meta", df_meta, ARQUIVO_META),
+        ("df_prices", df_prices, ARQUIVO_PRICES),
+        ("df_location", df_location, ARQUIVO_LOCATION),
+    ):
+        fontes[fonte] = preparar_ids(df, caminho)
+        relatorio[fonte] = {"sem_listing": len(df) - len(fontes[fonte])}
+    df_meta, df_prices, df_location = fontes.values()
 
-print(f"✅ Merge concluído")
-print(f"   - df_meta: {len(df_meta)} linhas")
-print(f"   - df_final: {len(df_final)} linhas")
+    # Duplicados no df_meta seguem para o resultado (uma linha por registro de performance)
+    relatorio["df_meta"]["duplicados"] = int(marcar_duplicados(df_meta["listing_id"].to_numpy()).sum())
+
+    df_merged, relatorio_prices = merge_join_por_id(df_meta, df_prices)
+    df_final, relatorio_location = merge_join_por_id(df_merged, df_location)
+    relatorio["df_prices"].update(relatorio_prices)
+    relatorio["df_location"].update(relatorio_location)
+    return df_final, relatorio
+
+def verificar_ordenacao(ids, caminho, anterior=None):
+    """Garante que os IDs de um bloco estão em ordem crescente e não voltam antes do bloco anterior"""
+    if not ids.is_monotonic_increasing or (anterior is not None and ids.iloc[0] < anterior):
+        raise ValueError(f"{caminho} não está ordenado por listing_id. Execute novamente o 1_import_data.py")
+
+def criar_leitor_ordenado(caminho, chunksize):
+    """Lê em blocos um CSV ordenado por listing_id.
+
+    Devolve duas funções e o estado do leitor: `proximas_ate(limite)` entrega as próximas linhas com
+    listing_id <= limite; `contar_restantes()` consome o resto do arquivo só contando chaves órfãs e
+    duplicadas. O estado guarda a contagem de linhas sem listing descartadas.
+    """
+    blocos = pd.read_csv(caminho, chunksize=chunksize)
+    estado = {"pendente": pd.DataFrame(), "ultimo": None, "sem_listing": 0}
+
+    def carregar_bloco():
+        """Coloca o próximo bloco não vazio em estado["pendente"]; devolve False no fim do arquivo"""
+        while estado["pendente"].empty:
+            bloco = next(blocos, None)
+            if bloco is None:
+                return False
+            exigir_listing_id(bloco, caminho)
+            estado["sem_listing"] += int(bloco["listing_id"].isna().sum())
+            bloco = bloco.dropna(subset=["listing_id"]).astype({"listing_id": "int64"})
+            if bloco.empty:
+                continue
+            verificar_ordenacao(bloco["listing_id"], caminho, estado["ultimo"])
+            estado["ultimo"] = bloco["listing_id"].iloc[-1]
+            estado["pendente"] = bloco
+        return True
+
+    def proximas_ate(limite):
+        partes = []
+        while carregar_bloco():
+            pendente = estado["pendente"]
+            # Como o arquivo está ordenado, as linhas até o limite formam um prefixo do bloco
+            corte = int(np.searchsorted(pendente["listing_id"].to_numpy(), limite, side="right"))
+            partes.append(pendente.iloc[:corte])
+            estado["pendente"] = pendente.iloc[corte:]
+            if corte < len(pendente):
+                break
+
+        if not partes:
+            return pd.read_csv(caminho, nrows=0)
+        return pd.concat(partes, ignore_index=True)
+
+    def contar_restantes():
+        contagens = {"duplicados": 0, "orfaos": 0}
+        anterior = None
+        while carregar_bloco():
+            ids = estado["pendente"]["listing_id"].to_numpy()
+            novos = np.r_[ids[0] != anterior, ids[1:] != ids[:-1]]
+            contagens["orfaos"] += int(novos.sum())
+            contagens["duplicados"] += int((~novos).sum())
+            anterior = ids[-1]
+            estado["pendente"] = estado["pendente"].iloc[:0]
+        return contagens
+
+    return proximas_ate, contar_restantes, estado
 
 # %%
-# Reordenar colunas
-colunas_ordenadas = [
+# Funções de métricas derivadas
+
+COLUNAS_ORDENADAS = [
     "listing",
     "categoria",
     "carteira",
@@ -93,70 +238,69 @@ colunas_ordenadas = [
     "ocupacao_ainda_disponivel"
 ]
 
-# Manter apenas colunas que existem no df_final
-colunas_ordenadas = [col for col in colunas_ordenadas if col in df_final.columns]
-df_final = df_final[colunas_ordenadas]
+def reordenar_colunas(df):
+    """Mantém apenas as colunas conhecidas, na ordem padrão"""
+    return df[[col for col in COLUNAS_ORDENADAS if col in df.columns]].copy()
 
-print("📋 Colunas reordenadas")
+# Limiares de criticidade e prioridade (compartilhados com o app)
+REGRAS = carregar_regras()
 
-# %%
-# Calcular atingimento da meta (evitar divisão por zero)
-print("\n📊 Calculando métricas derivadas...")
-df_final["atingimento_meta"] = df_final.apply(
-    lambda row: row["faturamento_mes"] / row["meta"] if row["meta"] > 0 else 0,
-    axis=1
-)
-
-# Classificar grupo de criticidade
-def classificar_criticidade(atingimento):
-    if atingimento <= 0.5:
-        return "crítico"
-    elif atingimento <= 0.8:
-        return "atenção"
-    elif atingimento <= 1.1:
-        return "berlinda"
-    elif atingimento <= 2.0:
-        return "ok"
+# Classificar status operacional
+def classificar_status(row):
+    if row["atingimento_meta"] >= 1.0:
+        if row["ocupacao_ainda_disponivel"] > 0:
+            if row["potencial_realista"] > row["meta"] * 1.1:
+                return "🟢 Acima com folga"
+            else:
+                return "🟡 Acima com risco"
+        else:
+            return "🟡 Acima sem ação"
     else:
-        return "meta_subestimada"
-
-df_final["grupo_criticidade"] = df_final["atingimento_meta"].apply(classificar_criticidade)
-
-# Arredondar atingimento para 2 casas
-df_final["atingimento_meta"] = df_final["atingimento_meta"].round(2)
+        if row["ocupacao_ainda_disponivel"] == 0:
+            return "🔴 Abaixo inviável"
+        elif row["dias_necessarios"] <= row["ocupacao_ainda_disponivel"] and row["potencial_realista"] >= row["meta"]:
+            return "🟢 Abaixo viável"
+        else:
+            return "🟠 Abaixo precisa esforço"
 
-print("✅ Métricas derivadas calculadas")
+def calcular_metricas(df_final):
+    """Calcula atingimento da meta e grupo de criticidade (dependem só da própria linha)"""
+    # Calcular atingimento da meta (evitar divisão por zero)
+    df_final["atingimento_meta"] = (df_final["faturamento_mes"] / df_final["meta"]).where(df_final["meta"] > 0, 0)
+    df_final["grupo_criticidade"] = classificar(df_final["atingimento_meta"], REGRAS["criticidade"])
 
-# %%
-# Calcular métricas para a Berlinda
-print("\n🎯 Calculando métricas específicas para Berlinda...")
+    # Arredondar atingimento para 2 casas
+    df_final["atingimento_meta"] = df_final["atingimento_meta"].round(2)
+    return df_final
 
-# Filtrar apenas Berlinda
-df_berlinda = df_final[df_final["grupo_criticidade"] == "berlinda"].copy()
+def calcular_metricas_berlinda(df_final):
+    """Filtra a Berlinda e calcula as métricas por linha, até o score bruto"""
+    df_berlinda = df_final[df_final["grupo_criticidade"] == "berlinda"].copy()
+    if df_berlinda.empty:
+        return df_berlinda
 
-if len(df_berlinda) > 0:
     # Calcular métricas adicionais
     df_berlinda["falta_meta"] = df_berlinda["meta"] - df_berlinda["faturamento_mes"]
-    
+
     # Calcular dias necessários (evitar divisão por zero)
     df_berlinda["dias_necessarios"] = df_berlinda.apply(
-        lambda row: np.ceil(row["falta_meta"] / row["media_preco_disponivel"]) 
+        lambda row: np.ceil(row["falta_meta"] / row["media_preco_disponivel"])
         if row["media_preco_disponivel"] > 0 else 0,
         axis=1
     )
-    
+
     # Calcular potencial máximo
     df_berlinda["potencial_max"] = (
-        df_berlinda["faturamento_mes"] + 
+        df_berlinda["faturamento_mes"] +
         (df_berlinda["ocupacao_ainda_disponivel"] * df_berlinda["media_preco_disponivel"])
     )
-    
+
     # Calcular potencial realista
     df_berlinda["potencial_realista"] = (
-        df_berlinda["faturamento_mes"] + 
+        df_berlinda["faturamento_mes"] +
         (df_berlinda["to_listings"] * df_berlinda["ocupacao_ainda_disponivel"] * df_berlinda["media_preco_disponivel"])
     )
-    
+
     # Calcular score bruto
     df_berlinda["score_bruto"] = (
         (df_berlinda["falta_meta"] / df_berlinda["meta"]) *
@@ -164,53 +308,265 @@ if len(df_berlinda) > 0:
         (df_berlinda["potencial_max"] - df_berlinda["faturamento_mes"]) *
         (1 / df_berlinda["dias_necessarios"].replace(0, 1))
     )
-    
+    return df_berlinda
+
+def finalizar_berlinda(df_berlinda):
+    """Normaliza o score sobre toda a Berlinda e classifica prioridade e status"""
     # Normalizar score por rank percentil
     df_berlinda["score_normalizado"] = df_berlinda["score_bruto"].rank(pct=True) * 100
-    
-    # Classificar prioridade
-    def classificar_prioridade(score):
-        if score >= 80:
-            return "Crítica"
-        elif score >= 50:
-            return "Média"
+    # Score ausente (sem preço disponível) fica com prioridade baixa
+    df_berlinda["prioridade"] = classificar(df_berlinda["score_normalizado"].fillna(0), REGRAS["prioridade"])
+    df_berlinda["status_operacional"] = df_berlinda.apply(classificar_status, axis=1)
+    return df_berlinda
+
+# %%
+# Funções de agregação
+
+TOP_K_CARTEIRA = 20
+NIVEIS_GEOGRAFICOS = ["estado", "cidade", "Bairro"]
+ORDEM_CRITICIDADE = REGRAS["criticidade"]["grupos"]
+COLUNAS_ROLLUP = ["nivel"] + NIVEIS_GEOGRAFICOS + ORDEM_CRITICIDADE + ["total_imoveis", "falta_meta"]
+
+def selecionar_top_k_por_carteira(df, k=TOP_K_CARTEIRA):
+    """Seleciona os k imóveis mais prioritários de cada carteira (maior score, menos dias necessários)"""
+    df_top = (
+        df.assign(carteira=df["carteira"].fillna("Não informado"))
+        .sort_values(["score_normalizado", "dias_necessarios"], ascending=[False, True])
+        .groupby("carteira")
+        .head(k)
+        .copy()
+    )
+    df_top["rank_carteira"] = df_top.groupby("carteira").cumcount() + 1
+    return df_top.sort_values(["carteira", "rank_carteira"], ignore_index=True)
+
+def calcular_rollup_geografico(df):
+    """Conta imóveis por grupo de criticidade e soma a falta de meta em cada nó da hierarquia"""
+    base = df[NIVEIS_GEOGRAFICOS + ["grupo_criticidade"]].copy()
+    base[NIVEIS_GEOGRAFICOS] = base[NIVEIS_GEOGRAFICOS].fillna("Não informado")
+    # Só conta o que falta para a meta (imóveis acima da meta entram com zero)
+    base["falta_meta"] = (df["meta"] - df["faturamento_mes"]).clip(lower=0)
+
+    rollups = []
+    for i, nivel in enumerate(NIVEIS_GEOGRAFICOS):
+        chaves = NIVEIS_GEOGRAFICOS[:i + 1]
+        df_nivel = (
+            base.groupby(chaves + ["grupo_criticidade"]).size()
+            .unstack(fill_value=0)
+            .reindex(columns=ORDEM_CRITICIDADE, fill_value=0)
+        )
+        df_nivel["total_imoveis"] = df_nivel.sum(axis=1)
+        df_nivel["falta_meta"] = base.groupby(chaves)["falta_meta"].sum()
+        df_nivel = df_nivel.reset_index()
+        df_nivel.insert(0, "nivel", nivel)
+        rollups.append(df_nivel)
+
+    return pd.concat(rollups, ignore_index=True).reindex(columns=COLUNAS_ROLLUP)
+
+def combinar_rollups(rollups):
+    """Soma rollups parciais (contagens e falta de meta são aditivas entre blocos)"""
+    chaves = ["nivel"] + NIVEIS_GEOGRAFICOS
+    ordem_nivel = {nivel: i for i, nivel in enumerate(NIVEIS_GEOGRAFICOS)}
+    df_rollup = pd.concat(rollups, ignore_index=True).groupby(chaves, dropna=False, sort=False).sum().reset_index()
+    return df_rollup.sort_values(
+        chaves, key=lambda col: col.map(ordem_nivel) if col.name == "nivel" else col, ignore_index=True
+    )
+
+# %%
+# Ler, juntar e calcular métricas por linha
+output_final = os.path.join(PROCESSED_DIR, "meta_analysis_final_enriched.csv")
+
+if not args.streaming:
+    # Ler os 3 arquivos CSV
+    try:
+        df_location = pd.read_csv(ARQUIVO_LOCATION)
+        df_meta = pd.read_csv(ARQUIVO_META)
+        df_prices = pd.read_csv(ARQUIVO_PRICES)
+        print("✅ Todos os arquivos CSV lidos com sucesso")
+    except FileNotFoundError as e:
+        print(f"❌ Erro ao ler arquivos: {e}")
+        print("Execute primeiro o script 1_import_data.py")
+        exit(1)
+
+    df_meta = renomear_colunas_meta(df_meta)
+    print("📝 Colunas renomeadas no df_meta")
+
+    # Verificar nomes das colunas
+    print("\n📌 Colunas de df_location:")
+    print(df_location.columns.tolist())
+
+    print("\n📌 Colunas de df_meta:")
+    print(df_meta.columns.tolist())
+
+    print("\n📌 Colunas de df_prices:")
+    print(df_prices.columns.tolist())
+
+    # Fazer merge entre os DataFrames
+    print("\n🔗 Realizando merges dos DataFrames...")
+    df_final, relatorio_join = juntar_fontes(df_meta, df_prices, df_location)
+
+    exibir_relatorio_join(relatorio_join)
+    print(f"✅ Merge concluído")
+    print(f"   - df_meta: {len(df_meta)} linhas")
+    print(f"   - df_final: {len(df_final)} linhas")
+
+    df_final = reordenar_colunas(df_final)
+    print("📋 Colunas reordenadas")
+
+    print("\n📊 Calculando métricas derivadas...")
+    df_final = calcular_metricas(df_final)
+    print("✅ Métricas derivadas calculadas")
+
+    print("\n🎯 Calculando métricas específicas para Berlinda...")
+    df_berlinda = calcular_metricas_berlinda(df_final)
+
+    print("\n🗺️ Calculando rollups geográficos...")
+    df_rollup_geo = calcular_rollup_geografico(df_final)
+
+    total_imoveis = len(df_final)
+    nulos = df_final.isnull().sum()
+
+    # Salvar DataFrame completo
+    df_final.to_csv(output_final, index=False, encoding='utf-8')
+
+else:
+    # Modo streaming: df_meta é lido em blocos e preços/localização avançam em paralelo pelos
+    # arquivos ordenados (sorted merge). Só a Berlinda volta inteira para a memória.
+    print(f"\n🌊 Modo streaming: blocos de {args.chunksize} linhas")
+    for caminho in (ARQUIVO_LOCATION, ARQUIVO_META, ARQUIVO_PRICES):
+        if not os.path.exists(caminho):
+            print(f"❌ Erro ao ler arquivos: {caminho} não encontrado")
+            print("Execute primeiro o script 1_import_data.py")
+            exit(1)
+
+    # O df_final é gravado bloco a bloco num arquivo temporário, que só substitui o anterior no fim:
+    # uma execução interrompida não deixa saída truncada para o app
+    output_final_parcial = os.path.join(PROCESSED_DIR, "meta_analysis_final_enriched_parcial.csv")
+    output_berlinda_parcial = os.path.join(PROCESSED_DIR, "berlinda_parcial.csv")
+    arquivos_parciais = (output_final_parcial, output_berlinda_parcial)
+    for caminho in arquivos_parciais:
+        if os.path.exists(caminho):
+            os.remove(caminho)
+
+    try:
+        proximos_precos, restantes_precos, estado_precos = criar_leitor_ordenado(ARQUIVO_PRICES, args.chunksize)
+        proximas_localizacoes, restantes_localizacoes, estado_localizacoes = criar_leitor_ordenado(
+            ARQUIVO_LOCATION, args.chunksize
+        )
+
+        # Acumuladores de tamanho fixo: nada cresce com o número de blocos
+        acumulado = {"rollup": None, "relatorio": None, "nulos": None, "total_imoveis": 0, "total_berlinda": 0}
+
+        def processar_bloco(bloco_meta, limite):
+            """Junta um bloco do df_meta aos preços/localizações até o limite, calcula as métricas e grava"""
+            bloco, relatorio_bloco = juntar_fontes(
+                bloco_meta, proximos_precos(limite), proximas_localizacoes(limite)
+            )
+            acumulado["relatorio"] = somar_relatorios(acumulado["relatorio"], relatorio_bloco)
+
+            bloco = calcular_metricas(reordenar_colunas(bloco))
+            bloco.to_csv(output_final_parcial, mode="a", header=not os.path.exists(output_final_parcial),
+                         index=False, encoding='utf-8')
+
+            rollup_bloco = calcular_rollup_geografico(bloco)
+            if acumulado["rollup"] is None:
+                acumulado["rollup"] = rollup_bloco
+            elif not rollup_bloco.empty:
+                acumulado["rollup"] = combinar_rollups([acumulado["rollup"], rollup_bloco])
+
+            nulos_bloco = bloco.isnull().sum()
+            acumulado["nulos"] = nulos_bloco if acumulado["nulos"] is None else acumulado["nulos"].add(nulos_bloco, fill_value=0).astype(int)
+            acumulado["total_imoveis"] += len(bloco)
+
+            bloco_berlinda = calcular_metricas_berlinda(bloco)
+            if not bloco_berlinda.empty:
+                bloco_berlinda.to_csv(output_berlinda_parcial, mode="a", header=not os.path.exists(output_berlinda_parcial),
+                                      index=False, encoding='utf-8')
+                acumulado["total_berlinda"] += len(bloco_berlinda)
+
+        meta_sem_listing = 0
+        em_aberto = None
+        for i, bloco_meta in enumerate(pd.read_csv(ARQUIVO_META, chunksize=args.chunksize)):
+            exigir_listing_id(bloco_meta, ARQUIVO_META)
+            meta_sem_listing += int(bloco_meta["listing_id"].isna().sum())
+            bloco_meta = renomear_colunas_meta(bloco_meta).dropna(subset=["listing_id"]).astype({"listing_id": "int64"})
+            if em_aberto is not None:
+                bloco_meta = pd.concat([em_aberto, bloco_meta], ignore_index=True)
+            if bloco_meta.empty:
+                continue
+            ids = bloco_meta["listing_id"]
+            verificar_ordenacao(ids, ARQUIVO_META)
+
+            # Linhas do último listing podem continuar no próximo bloco: ficam em aberto até lá,
+            # para que duplicados do df_meta encontrem o mesmo preço/localização
+            ultimo = (ids == ids.iloc[-1]).to_numpy()
+            em_aberto = bloco_meta[ultimo]
+            if not ultimo.all():
+                processar_bloco(bloco_meta[~ultimo], ids[~ultimo].iloc[-1])
+                print(f"   - Bloco {i + 1}: {acumulado['total_imoveis']} linhas processadas")
+
+        if em_aberto is not None:
+            processar_bloco(em_aberto, em_aberto["listing_id"].iloc[-1])
         else:
-            return "Baixa"
-    
-    df_berlinda["prioridade"] = df_berlinda["score_normalizado"].apply(classificar_prioridade)
-    
-    # Classificar status operacional
-    def classificar_status(row):
-        if row["atingimento_meta"] >= 1.0:
-            if row["ocupacao_ainda_disponivel"] > 0:
-                if row["potencial_realista"] > row["meta"] * 1.1:
-                    return "🟢 Acima com folga"
-                else:
-                    return "🟡 Acima com risco"
-            else:
-                return "🟡 Acima sem ação"
+            # Arquivo de performance sem linhas: gera as saídas vazias como no modo em memória
+            processar_bloco(renomear_colunas_meta(pd.read_csv(ARQUIVO_META, nrows=0)), -1)
+
+        # Preços e localizações depois do último listing do df_meta também são órfãos
+        relatorio_join = acumulado["relatorio"]
+        relatorio_join["df_meta"]["sem_listing"] += meta_sem_listing
+        for fonte, contar_restantes, estado_leitor in (
+            ("df_prices", restantes_precos, estado_precos),
+            ("df_location", restantes_localizacoes, estado_localizacoes),
+        ):
+            restantes = contar_restantes()
+            relatorio_join[fonte]["orfaos"] += restantes["orfaos"]
+            relatorio_join[fonte]["duplicados"] += restantes["duplicados"]
+            # Linhas sem listing são descartadas pelo leitor antes do join
+            relatorio_join[fonte]["sem_listing"] += estado_leitor["sem_listing"]
+        exibir_relatorio_join(relatorio_join)
+
+        total_imoveis = acumulado["total_imoveis"]
+        nulos = acumulado["nulos"]
+        print(f"✅ Blocos concluídos: {total_imoveis} linhas")
+
+        # Segunda passagem: só a Berlinda é relida para o rank global do score
+        print("\n🎯 Calculando métricas específicas para Berlinda...")
+        if acumulado["total_berlinda"] > 0:
+            df_berlinda = pd.read_csv(output_berlinda_parcial)
         else:
-            if row["ocupacao_ainda_disponivel"] == 0:
-                return "🔴 Abaixo inviável"
-            elif row["dias_necessarios"] <= row["ocupacao_ainda_disponivel"] and row["potencial_realista"] >= row["meta"]:
-                return "🟢 Abaixo viável"
-            else:
-                return "🟠 Abaixo precisa esforço"
-    
-    df_berlinda["status_operacional"] = df_berlinda.apply(classificar_status, axis=1)
-    
+            df_berlinda = pd.DataFrame()
+
+        df_rollup_geo = acumulado["rollup"]
+
+        os.replace(output_final_parcial, output_final)
+    finally:
+        for caminho in arquivos_parciais:
+            if os.path.exists(caminho):
+                os.remove(caminho)
+
+# %%
+# Finalizar a Berlinda (rank percentil sobre todos os imóveis da Berlinda)
+if len(df_berlinda) > 0:
+    df_berlinda = finalizar_berlinda(df_berlinda)
     print(f"✅ Métricas da Berlinda calculadas para {len(df_berlinda)} imóveis")
+
+    print("\n🏆 Selecionando Top K por carteira...")
+    df_top_carteira = selecionar_top_k_por_carteira(df_berlinda)
+    print(f"✅ Top {TOP_K_CARTEIRA} selecionado para {df_top_carteira['carteira'].nunique()} carteiras")
 else:
     print("⚠️ Nenhum imóvel encontrado na Berlinda")
     df_berlinda = pd.DataFrame()  # DataFrame vazio
+    df_top_carteira = pd.DataFrame()
+
+df_rollup_geo["falta_meta"] = df_rollup_geo["falta_meta"].round(2)
+print(f"✅ Rollups calculados para {len(df_rollup_geo)} nós")
+for nivel in NIVEIS_GEOGRAFICOS:
+    print(f"   - {nivel}: {(df_rollup_geo['nivel'] == nivel).sum()} nós")
 
 # %%
 # Salvar resultados
 print("\n💾 Salvando arquivos processados...")
 
-# Salvar DataFrame completo
-output_final = os.path.join(PROCESSED_DIR, "meta_analysis_final_enriched.csv")
-df_final.to_csv(output_final, index=False, encoding='utf-8')
+# DataFrame completo (no modo streaming já foi gravado bloco a bloco)
 print(f"✅ Salvo: {output_final}")
 
 # Salvar DataFrame da Berlinda
@@ -219,20 +575,30 @@ if len(df_berlinda) > 0:
     df_berlinda.to_csv(output_berlinda, index=False, encoding='utf-8')
     print(f"✅ Salvo: {output_berlinda}")
 
+    # Salvar Top K por carteira
+    output_top_carteira = os.path.join(PROCESSED_DIR, "berlinda_top_carteira.csv")
+    df_top_carteira.to_csv(output_top_carteira, index=False, encoding='utf-8')
+    print(f"✅ Salvo: {output_top_carteira}")
+
+# Salvar rollups geográficos
+output_rollup_geo = os.path.join(PROCESSED_DIR, "geo_rollup.csv")
+df_rollup_geo.to_csv(output_rollup_geo, index=False, encoding='utf-8')
+print(f"✅ Salvo: {output_rollup_geo}")
+
 # %%
 # Exibir estatísticas finais
 print("\n📊 Estatísticas finais:")
-print(f"📈 Total de imóveis analisados: {len(df_final)}")
+print(f"📈 Total de imóveis analisados: {total_imoveis}")
 print(f"🎯 Imóveis na Berlinda: {len(df_berlinda)}")
 
 if len(df_berlinda) > 0:
     print("\n📋 Distribuição de status na Berlinda:")
     print(df_berlinda["status_operacional"].value_counts())
-    
+
     print("\n📋 Distribuição de prioridade na Berlinda:")
     print(df_berlinda["prioridade"].value_counts())
 
 print("\n📉 Valores nulos no DataFrame final:")
-print(df_final.isnull().sum())
+print(nulos)
 
 print("\n🎉 Processamento concluído com sucesso!")
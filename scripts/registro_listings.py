@@ -0,0 +1,43 @@
+import os
+import numpy as np
+import pandas as pd
+
+# O registro é mantido pelo 1_import_data.py, junto dos CSVs brutos que ele codifica
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+ARQUIVO_REGISTRO = os.path.join(PROJECT_ROOT, 'data', 'raw', 'listing_registry.csv')
+
+def carregar_registro(caminho=ARQUIVO_REGISTRO):
+    """Lê o registro de listings; o ID de cada código é a sua posição no registro"""
+    if not os.path.exists(caminho):
+        return pd.Index([], dtype=object, name="listing")
+    df_registro = pd.read_csv(caminho, dtype={"listing": str})
+    if not np.array_equal(df_registro["listing_id"].to_numpy(), np.arange(len(df_registro))):
+        raise ValueError(f"{caminho}: listing_id precisa ser a sequência 0, 1, 2, ...")
+    registro = pd.Index(df_registro["listing"], name="listing")
+    if not registro.is_unique:
+        raise ValueError(f"{caminho}: listing repetido no registro")
+    return registro
+
+def codificar_listings(df, registro):
+    """Adiciona a coluna listing_id ao lado de listing e devolve também o registro atualizado.
+
+    Códigos novos entram no fim do registro, então os IDs já atribuídos nunca mudam.
+    A consulta é por tabela hash (tempo linear). Linhas sem listing ficam sem ID.
+    """
+    validos = df["listing"].notna()
+    codigos = df.loc[validos, "listing"].astype(str)
+    novos = pd.unique(codigos[registro.get_indexer(codigos) == -1])
+    if len(novos):
+        registro = registro.append(pd.Index(novos, name="listing"))
+
+    df = df.drop(columns="listing_id", errors="ignore")
+    ids = pd.Series(registro.get_indexer(codigos), index=codigos.index)
+    df.insert(df.columns.get_loc("listing") + 1, "listing_id", ids.reindex(df.index).astype("Int64"))
+    return df, registro
+
+def salvar_registro(registro, caminho=ARQUIVO_REGISTRO):
+    """Grava o registro com os IDs explícitos"""
+    pd.DataFrame({"listing_id": np.arange(len(registro)), "listing": registro}).to_csv(
+        caminho, index=False, encoding='utf-8'
+    )
@@ -0,0 +1,41 @@
+import os
+import numpy as np
+import pandas as pd
+
+# A tabela de regras é lida tanto pelo 2_data_prepar.py quanto pelo streamlit_app.py
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+ARQUIVO_REGRAS = os.path.join(PROJECT_ROOT, 'data', 'regras_classificacao.csv')
+
+def carregar_regras(caminho=ARQUIVO_REGRAS):
+    """Lê a tabela de regras e devolve, por tipo, os grupos em ordem crescente e seus limites superiores.
+
+    O último grupo de cada tipo não tem limite. Com inclusivo=True o valor igual ao limite
+    fica no grupo (valor <= limite); com inclusivo=False passa para o grupo seguinte (valor < limite).
+    """
+    df_regras = pd.read_csv(caminho)
+    regras = {}
+    for tipo, df_tipo in df_regras.groupby("tipo", sort=False):
+        limites = df_tipo["limite_superior"].iloc[:-1].astype(float).tolist()
+        if df_tipo["limite_superior"].iloc[:-1].isna().any() or pd.notna(df_tipo["limite_superior"].iloc[-1]):
+            raise ValueError(f"Regra '{tipo}': apenas o último grupo pode ficar sem limite superior")
+        if any(a >= b for a, b in zip(limites, limites[1:])):
+            raise ValueError(f"Regra '{tipo}': limites precisam ser crescentes")
+        if df_tipo["inclusivo"].nunique() > 1:
+            raise ValueError(f"Regra '{tipo}': 'inclusivo' precisa ser igual em todas as linhas")
+        regras[tipo] = {
+            "grupos": df_tipo["grupo"].tolist(),
+            "limites": limites,
+            "inclusivo": bool(df_tipo["inclusivo"].iloc[0]),
+        }
+    return regras
+
+def classificar(valores, regra, limites=None):
+    """Classifica um array de valores por busca binária nos limites da regra (ou em limites alternativos).
+
+    Valores ausentes caem no último grupo.
+    """
+    limites = regra["limites"] if limites is None else limites
+    lado = "left" if regra["inclusivo"] else "right"
+    posicoes = np.searchsorted(np.asarray(limites, dtype=float), np.asarray(valores, dtype=float), side=lado)
+    return np.asarray(regra["grupos"], dtype=object)[posicoes]
@@ -1,6 +1,7 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
+import numpy as np
 import os
 import sys
 
@@ -11,6 +12,10 @@ PROJECT_ROOT = os.path.dirname(APP_DIR)
 # Adicionar o diretório raiz ao path para importações futuras
 sys.path.insert(0, PROJECT_ROOT)
 
+# Tabela de regras de classificação compartilhada com scripts/2_data_prepar.py
+sys.path.insert(0, os.path.join(APP_DIR, "scripts"))
+from regras_classificacao import carregar_regras, classificar
+
 # Configuração da página
 st.set_page_config(page_title="Meta Performance Dashboard", layout="wide")
 
@@ -41,6 +46,57 @@ def load_berlinda():
         st.error("Execute primeiro: python scripts/2_prepare_data.py")
         return pd.DataFrame()
 
+@st.cache_data
+def load_regras():
+    """Carrega a tabela de limiares de criticidade e prioridade"""
+    return carregar_regras()
+
+def descrever_faixas(regra, limites, formato):
+    """Monta o texto da faixa de cada grupo a partir dos limites superiores"""
+    primeiro, ultimo = ("≤", ">") if regra["inclusivo"] else ("<", "≥")
+    grupos = regra["grupos"]
+    faixas = {
+        grupos[0]: f"{primeiro} {formato(limites[0])}",
+        grupos[-1]: f"{ultimo} {formato(limites[-1])}"
+    }
+    for grupo, inferior, superior in zip(grupos[1:-1], limites[:-1], limites[1:]):
+        faixas[grupo] = f"{formato(inferior)}–{formato(superior)}"
+    return faixas
+
+@st.cache_data
+def load_top_carteira():
+    """Carrega o Top K pré-calculado da Berlinda indexado por carteira"""
+    try:
+        caminho = os.path.join(PROJECT_ROOT, "meta-performance-dashboard/data/processed/berlinda_top_carteira.csv")
+        df_top = pd.read_csv(caminho)
+    except FileNotFoundError:
+        return {}
+    return {
+        carteira: df_carteira.sort_values("rank_carteira")
+        for carteira, df_carteira in df_top.groupby("carteira")
+    }
+
+@st.cache_data
+def load_geo_rollup():
+    """Carrega os rollups geográficos indexados pelo caminho do nó pai"""
+    try:
+        caminho = os.path.join(PROJECT_ROOT, "meta-performance-dashboard/data/processed/geo_rollup.csv")
+        df_rollup = pd.read_csv(caminho)
+    except FileNotFoundError:
+        return {}
+
+    # Cada chave é o caminho do nó pai: () → estados, (estado,) → cidades, (estado, cidade) → bairros
+    niveis = ["estado", "cidade", "Bairro"]
+    filhos = {}
+    for i, nivel in enumerate(niveis):
+        df_nivel = df_rollup[df_rollup["nivel"] == nivel]
+        if i == 0:
+            filhos[()] = df_nivel
+        else:
+            for chave, df_filhos in df_nivel.groupby(niveis[:i]):
+                filhos[tuple(chave)] = df_filhos
+    return filhos
+
 # Título
 st.title("📊 Meta Performance Dashboard")
 
@@ -83,6 +139,60 @@ cidade_sel = st.sidebar.multiselect("Cidade", options=cidades, default=[])
 grupo_sel = st.sidebar.multiselect("Grupo de Criticidade", options=grupos, default=[])
 dias_min = st.sidebar.number_input("Mínimo de Dias Disponíveis", min_value=0, max_value=30, value=0, step=1)
 
+# --- LIMIARES DE CLASSIFICAÇÃO ---
+regras = load_regras()
+regra_criticidade = regras["criticidade"]
+regra_prioridade = regras["prioridade"]
+
+with st.sidebar.expander("⚙️ Limiares de Classificação"):
+    st.caption(
+        "Simule cortes alternativos sem reprocessar os dados. O drill-down geográfico (rollups pré-calculados) "
+        "e a Berlinda Detalhada continuam usando a classificação da preparação."
+    )
+    # Faixa dos sliders derivada da tabela: de 0 (ou do menor limite) até o dobro do maior limite
+    limites_criticidade = [
+        st.slider(
+            f"Limite de '{grupo}' (atingimento)",
+            min_value=min(0.0, regra_criticidade["limites"][0]),
+            max_value=float(np.ceil(2 * regra_criticidade["limites"][-1])),
+            value=float(limite),
+            step=0.01
+        )
+        for grupo, limite in zip(regra_criticidade["grupos"], regra_criticidade["limites"])
+    ]
+    limites_prioridade = [
+        st.slider(
+            f"Limite de '{grupo}' (score)",
+            min_value=min(0.0, regra_prioridade["limites"][0]),
+            max_value=max(100.0, regra_prioridade["limites"][-1]),
+            value=float(limite),
+            step=0.5
+        )
+        for grupo, limite in zip(regra_prioridade["grupos"], regra_prioridade["limites"])
+    ]
+
+if any(a >= b for a, b in zip(limites_criticidade, limites_criticidade[1:])):
+    st.sidebar.error("Os limites de criticidade precisam ser crescentes. Usando a tabela de regras.")
+    limites_criticidade = regra_criticidade["limites"]
+if any(a >= b for a, b in zip(limites_prioridade, limites_prioridade[1:])):
+    st.sidebar.error("Os limites de prioridade precisam ser crescentes. Usando a tabela de regras.")
+    limites_prioridade = regra_prioridade["limites"]
+
+# Reclassificar em memória por busca binária apenas se os limites mudaram
+criticidade_alterada = not np.allclose(limites_criticidade, regra_criticidade["limites"])
+prioridade_alterada = not np.allclose(limites_prioridade, regra_prioridade["limites"])
+if criticidade_alterada:
+    # Mesma razão sem arredondamento que o 2_data_prepar.py classifica (atingimento_meta é só para exibição)
+    atingimento = (df["faturamento_mes"] / df["meta"]).where(df["meta"] > 0, 0)
+    df["grupo_criticidade"] = classificar(atingimento.to_numpy(), regra_criticidade, limites_criticidade)
+if prioridade_alterada and not df_berlinda.empty:
+    df_berlinda["prioridade"] = classificar(
+        df_berlinda["score_normalizado"].fillna(0).to_numpy(), regra_prioridade, limites_prioridade
+    )
+
+faixas_criticidade = descrever_faixas(regra_criticidade, limites_criticidade, lambda v: f"{v:.0%}")
+faixas_prioridade = descrever_faixas(regra_prioridade, limites_prioridade, lambda v: f"{v:.0f}")
+
 # Aplicar filtros no dataset principal
 df_filtered = df.copy()
 if categoria_sel:
@@ -124,7 +234,7 @@ tab1, tab2 = st.tabs(["📊 Visão Geral", "🎯 Berlinda Detalhada"])
 # =============== ABA 1: VISÃO GERAL ===============
 with tab1:
     st.subheader("📌 Visão Geral de Performance")
-    st.caption("Foco na Berlinda: imóveis entre 80–110% da meta com potencial de ação.")
+    st.caption(f"Foco na Berlinda: imóveis entre {faixas_criticidade['berlinda']} da meta com potencial de ação.")
 
     # Calcular métricas
     total_imoveis = len(df_filtered)
@@ -134,7 +244,7 @@ with tab1:
     col_kpi1, col_kpi2, col_kpi3, col_kpi4 = st.columns(4)
     col_kpi1.metric("Listings Analisados", f"{total_imoveis:,}")
     perc_berlinda = len(berlinda_df) / total_imoveis * 100 if total_imoveis > 0 else 0
-    col_kpi2.metric("Na Berlinda (80–110%)", f"{perc_berlinda:.1f}%")
+    col_kpi2.metric(f"Na Berlinda ({faixas_criticidade['berlinda']})", f"{perc_berlinda:.1f}%")
     col_kpi3.metric("Com Potencial de Ação", f"{len(berlinda_com_potencial)}")
 
     # --- GRÁFICO DE BARRAS ---
@@ -145,19 +255,20 @@ with tab1:
     criticidade_counts["percentual"] = (criticidade_counts["quantidade"] / total * 100).round(1)
     criticidade_counts["percentual_str"] = criticidade_counts["percentual"].astype(str) + "%"
 
-    ordem = ["crítico", "atenção", "berlinda", "ok", "meta_subestimada"]
+    ordem = regra_criticidade["grupos"]
+    cores_criticidade = {
+        "crítico": "#d32f2f",
+        "atenção": "#f57c00",
+        "berlinda": "#388e3c",
+        "ok": "#1976d2",
+        "meta_subestimada": "#7b1fa2"
+    }
     criticidade_counts["grupo_criticidade"] = pd.Categorical(
         criticidade_counts["grupo_criticidade"], categories=ordem, ordered=True
     )
     criticidade_counts = criticidade_counts.sort_values("grupo_criticidade")
 
-    label_map = {
-        "crítico": "crítico (≤ 50%)",
-        "atenção": "atenção (50%–80%)",
-        "berlinda": "berlinda (80–110%)",
-        "ok": "ok (110%–200%)",
-        "meta_subestimada": "meta_subestimada (> 200%)"
-    }
+    label_map = {grupo: f"{grupo} ({faixa})" for grupo, faixa in faixas_criticidade.items()}
     criticidade_counts["grupo_legenda"] = criticidade_counts["grupo_criticidade"].map(label_map)
 
     fig1 = px.bar(
@@ -166,13 +277,7 @@ with tab1:
         y="quantidade",
         text="percentual_str",
         color="grupo_criticidade",
-        color_discrete_map={
-            "crítico": "#d32f2f",
-            "atenção": "#f57c00",
-            "berlinda": "#388e3c",
-            "ok": "#1976d2",
-            "meta_subestimada": "#7b1fa2"
-        },
+        color_discrete_map=cores_criticidade,
         labels={"grupo_legenda": "Grupo de Criticidade", "quantidade": "Quantidade"},
         title="Quantidade por Grupo"
     )
@@ -191,7 +296,7 @@ with tab1:
         aggfunc='count',
         fill_value=0
     )
-    ordem_grupos = ["crítico", "atenção", "berlinda", "ok", "meta_subestimada"]
+    ordem_grupos = regra_criticidade["grupos"]
     heatmap_abs = heatmap_abs.reindex(columns=ordem_grupos, fill_value=0)
     heatmap_prop = heatmap_abs.div(heatmap_abs.sum(axis=1), axis=0) * 100
     heatmap_prop = heatmap_prop.fillna(0)
@@ -206,6 +311,60 @@ with tab1:
     )
     st.plotly_chart(fig_heatmap, use_container_width=True)
 
+    # --- DRILL-DOWN GEOGRÁFICO ---
+    st.subheader("Drill-down Geográfico: Estado → Cidade → Bairro")
+    st.caption("Rollups pré-calculados na preparação dos dados (não consideram os filtros da barra lateral).")
+    if criticidade_alterada:
+        faixas_tabela = descrever_faixas(regra_criticidade, regra_criticidade["limites"], lambda v: f"{v:.0%}")
+        st.warning(
+            "Os limiares de criticidade foram alterados na barra lateral, mas os rollups geográficos seguem "
+            "a tabela de regras (" + ", ".join(f"{grupo} {faixas_tabela[grupo]}" for grupo in regra_criticidade["grupos"]) +
+            "). As contagens por grupo abaixo podem divergir dos gráficos acima."
+        )
+
+    geo_filhos = load_geo_rollup()
+    if not geo_filhos:
+        st.info("Rollups geográficos não encontrados. Execute: python scripts/2_data_prepar.py")
+    else:
+        col_geo1, col_geo2 = st.columns(2)
+        estado_drill = col_geo1.selectbox(
+            "Estado", options=["Todos"] + sorted(geo_filhos[()]["estado"].tolist())
+        )
+        caminho_geo = ()
+        if estado_drill != "Todos":
+            caminho_geo = (estado_drill,)
+            cidade_drill = col_geo2.selectbox(
+                "Cidade", options=["Todas"] + sorted(geo_filhos.get(caminho_geo, pd.DataFrame(columns=["cidade"]))["cidade"].tolist())
+            )
+            if cidade_drill != "Todas":
+                caminho_geo = (estado_drill, cidade_drill)
+
+        # Só os filhos do nó selecionado são enviados ao navegador
+        coluna_no = ["estado", "cidade", "Bairro"][len(caminho_geo)]
+        df_nos = geo_filhos.get(caminho_geo, pd.DataFrame())
+
+        if df_nos.empty:
+            st.info("Nenhum nó encontrado para a seleção.")
+        else:
+            df_nos = df_nos.sort_values("falta_meta", ascending=False)
+            fig_treemap = px.treemap(
+                df_nos,
+                path=[coluna_no],
+                values="total_imoveis",
+                color="falta_meta",
+                color_continuous_scale="Reds",
+                hover_data=ordem_grupos,
+                labels={"total_imoveis": "Imóveis", "falta_meta": "Falta Meta (R$)"},
+                title=f"Imóveis por {coluna_no} (cor: falta para a meta)"
+            )
+            st.plotly_chart(fig_treemap, use_container_width=True)
+
+            st.dataframe(
+                df_nos[[coluna_no] + ordem_grupos + ["total_imoveis", "falta_meta"]],
+                use_container_width=True,
+                hide_index=True
+            )
+
     # --- SCATTER PLOT ---
     st.subheader("Scatter Plot: Análise de Performance")
     x_options = ['ocupacao_ainda_disponivel', 'to_listings']
@@ -220,13 +379,7 @@ with tab1:
         x=x_col,
         y='atingimento_meta',
         color='grupo_criticidade',
-        color_discrete_map={
-            "crítico": "#d32f2f",
-            "atenção": "#f57c00",
-            "berlinda": "#388e3c",
-            "ok": "#1976d2",
-            "meta_subestimada": "#7b1fa2"
-        },
+        color_discrete_map=cores_criticidade,
         hover_data=valid_hover_cols,
         labels={
             x_col: x_col.replace('_', ' ').title(),
@@ -235,9 +388,12 @@ with tab1:
         },
         title=f"{x_col.replace('_', ' ').title()} vs Atingimento da Meta"
     )
-    fig2.add_hline(y=0.5, line_dash="dot", line_color="#d32f2f", annotation_text="50% (Crítico)")
-    fig2.add_hline(y=0.8, line_dash="dot", line_color="#f57c00", annotation_text="80% (Berlinda)")
-    fig2.add_hline(y=1.1, line_dash="dot", line_color="#1976d2", annotation_text="110% (OK)")
+    # Uma linha por limite da tabela, marcando o teto de cada grupo
+    for grupo, limite in zip(regra_criticidade["grupos"], limites_criticidade):
+        fig2.add_hline(
+            y=limite, line_dash="dot", line_color=cores_criticidade.get(grupo, "#757575"),
+            annotation_text=f"{limite:.0%} (limite {grupo})"
+        )
     fig2.update_layout(yaxis_tickformat='.0%')
     st.plotly_chart(fig2, use_container_width=True)
 
@@ -254,7 +410,7 @@ with tab1:
 # =============== ABA 2: BERLINDA DETALHADA ===============
 with tab2:
     st.subheader("🎯 Dashboard da Berlinda")
-    st.caption("Análise tática dos imóveis entre 80–110% da meta, com foco em ação operacional.")   
+    st.caption(f"Análise tática dos imóveis entre {faixas_criticidade['berlinda']} da meta, com foco em ação operacional.")
 
     if df_berlinda_filtered.empty:
         st.warning("Nenhum imóvel na Berlinda com os filtros aplicados.")
@@ -344,53 +500,81 @@ with tab2:
     else:
         st.info("Nenhum imóvel com dias disponíveis para análise.")
 
-    st.markdown("""
+    st.markdown(f"""
     ##### 🎯 O que é a "Prioridade"?
     É um **score de 0 a 100** que indica **quão crítico é agir agora**:
-    - **Crítica (80–100)**: Alto impacto + baixo esforço (ex: falta 1 dia para bater meta).
-    - **Média (50–79)**: Viável, mas exige atenção.
-    - **Baixa (0–49)**: Pouco impacto ou inviável.
+    - **Crítica ({faixas_prioridade['Crítica']})**: Alto impacto + baixo esforço (ex: falta 1 dia para bater meta).
+    - **Média ({faixas_prioridade['Média']})**: Viável, mas exige atenção.
+    - **Baixa ({faixas_prioridade['Baixa']})**: Pouco impacto ou inviável.
     - **Baseado em**: proximidade da meta, dias disponíveis e potencial de ajuste.
     """)
 
     # --- TABELA OPERACIONAL ---
     st.subheader("Tabela Operacional")
+    modo_tabela = st.radio("Modo", options=["Lista completa", "Top N por carteira"], horizontal=True)
+
+    # Colunas expandidas
+    col_order = [
+        'listing', 'carteira', 'estado', 'status_operacional', 'prioridade',
+        'faturamento_mes', 'meta', 'falta_meta',
+        'ocupacao_ainda_disponivel', 'dias_necessarios',
+        'to_listings', 'media_preco_disponivel',
+        'score_normalizado'
+    ]
+
+    # Verificar quais colunas existem no dataframe
+    col_order = [col for col in col_order if col in df_berlinda_filtered.columns]
+
+    if modo_tabela == "Top N por carteira":
+        top_por_carteira = load_top_carteira()
+        if not top_por_carteira:
+            st.info("Top por carteira não encontrado. Execute: python scripts/2_data_prepar.py")
+            st.stop()
+
+        st.caption("Ranking pré-calculado por carteira; os filtros de categoria, estado, cidade e mínimo de dias disponíveis não se aplicam.")
+        col_top1, col_top2 = st.columns(2)
+        with col_top1:
+            opcoes_carteira = [c for c in top_por_carteira if not carteira_sel or c in carteira_sel]
+            carteira_top = st.selectbox("Carteira", options=opcoes_carteira)
+        with col_top2:
+            k_max = int(max(len(df_top) for df_top in top_por_carteira.values()))
+            top_n = st.slider("Top N", min_value=1, max_value=k_max, value=min(10, k_max))
+
+        df_top = top_por_carteira.get(carteira_top, pd.DataFrame(columns=col_order + ['rank_carteira'])).copy()
+        if prioridade_alterada:
+            df_top['prioridade'] = classificar(df_top['score_normalizado'].fillna(0).to_numpy(), regra_prioridade, limites_prioridade)
+        # Opções de status e prioridade vêm do Top K da carteira, sem os filtros da barra lateral
+        df_opcoes = df_top
+    else:
+        df_opcoes = df_berlinda_filtered
+
     col_filt1, col_filt2 = st.columns(2)
     with col_filt1:
         filtro_status = st.multiselect(
             "Filtrar por Status",
-            options=df_berlinda_filtered['status_operacional'].unique(),
-            default=df_berlinda_filtered['status_operacional'].unique()
+            options=df_opcoes['status_operacional'].unique(),
+            default=df_opcoes['status_operacional'].unique()
         )
     with col_filt2:
         filtro_prioridade = st.multiselect(
             "Filtrar por Prioridade",
-            options=df_berlinda_filtered['prioridade'].unique(),
-            default=df_berlinda_filtered['prioridade'].unique()
+            options=df_opcoes['prioridade'].unique(),
+            default=df_opcoes['prioridade'].unique()
         )
 
     # Aplicar filtros locais
-    df_tabela_filtrada = df_berlinda_filtered[
-        (df_berlinda_filtered['status_operacional'].isin(filtro_status)) &
-        (df_berlinda_filtered['prioridade'].isin(filtro_prioridade))
+    df_tabela_filtrada = df_opcoes[
+        (df_opcoes['status_operacional'].isin(filtro_status)) &
+        (df_opcoes['prioridade'].isin(filtro_prioridade))
     ]
 
-    # Colunas expandidas
-    col_order = [
-        'listing', 'carteira', 'estado', 'status_operacional', 'prioridade',
-        'faturamento_mes', 'meta', 'falta_meta',
-        'ocupacao_ainda_disponivel', 'dias_necessarios',
-        'to_listings', 'media_preco_disponivel',
-        'score_normalizado'
-    ]
-
-    # Verificar quais colunas existem no dataframe
-    col_order = [col for col in col_order if col in df_tabela_filtrada.columns]
-
-    df_tabela_final = df_tabela_filtrada[col_order].sort_values(
-        ['prioridade', 'score_normalizado', 'dias_necessarios'],
-        ascending=[False, False, True]
-    )
+    if modo_tabela == "Top N por carteira":
+        df_tabela_final = df_tabela_filtrada.head(top_n)[['rank_carteira'] + col_order]
+    else:
+        df_tabela_final = df_tabela_filtrada[col_order].sort_values(
+            ['prioridade', 'score_normalizado', 'dias_necessarios'],
+            ascending=[False, False, True]
+        )
 
     st.dataframe(df_tabela_final, use_container_width=True, height=500)
 